@@ -4,14 +4,17 @@ Entrypoint for Gradio, see https://gradio.app/
 
 import platform
 import asyncio
-import base64
+import hashlib
+import logging
 import os
 import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from enum import StrEnum
-from functools import partial
+from functools import lru_cache, partial
 from pathlib import Path
-from typing import cast, Dict, AsyncGenerator, Generator
+from typing import cast, Dict, AsyncGenerator
 
 import gradio as gr
 from anthropic import APIResponse
@@ -20,16 +23,23 @@ from anthropic.types.beta import BetaMessage, BetaTextBlock, BetaToolUseBlock
 from anthropic.types.tool_use_block import ToolUseBlock
 from fastapi import FastAPI, Request, HTTPException, Form
 from fastapi.responses import JSONResponse
-from threading import Thread
 import uvicorn
 
 from screeninfo import get_monitors
 from fastapi.middleware.cors import CORSMiddleware
-import nest_asyncio
 from fastapi.responses import StreamingResponse
-from openai import OpenAI
-
-nest_asyncio.apply()
+try:
+    import aiofiles
+except ImportError:
+    aiofiles = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    from pybase64 import b64decode as _b64decode  # SIMD-accelerated
+except ImportError:
+    from base64 import b64decode as _b64decode
 
 # TODO: I don't know why If don't get monitors here, the screen resolution will be wrong for secondary screen. Seems there are some conflict with computer_use_demo.tools
 screens = get_monitors()
@@ -41,9 +51,12 @@ from computer_use_demo.loop import (
     sampling_loop_sync,
 )
 
+from computer_use_demo.llm_cache import LLMCache
 from computer_use_demo.tools import ToolResult
 from computer_use_demo.tools.computer import get_screen_details
 
+logger = logging.getLogger(__name__)
+
 CONFIG_DIR = Path("~/.anthropic").expanduser()
 API_KEY_FILE = CONFIG_DIR / "api_key"
 
@@ -51,8 +64,19 @@ WARNING_TEXT = "⚠️ Security Alert: Never provide access to sensitive account
 
 SELECTED_SCREEN_INDEX = None
 SCREEN_NAMES = None
+
+# Optional response cache; set LLM_CACHE=1 to replay transcripts for repeated prompts
+LLM_CACHE = LLMCache.from_env()
 ANTHROPIC_KEY = "*************************FILL THE API KEY************************"
 
+# Dropdown choices never change at runtime; build them once instead of
+# re-enumerating the enum on every render
+_PROVIDER_CHOICES = tuple(option.value for option in APIProvider)
+
+# Computed once at import; setup_state runs per request and should not redo this
+_DEVICE_OS_NAME = "Windows" if platform.system() == "Windows" else "Mac" if platform.system() == "Darwin" else "Linux"
+_DEFAULT_SYSTEM_PROMPT_SUFFIX = f"\n\nNOTE: you are operating a {_DEVICE_OS_NAME} machine"
+
 
 class Sender(StrEnum):
     USER = "user"
@@ -60,36 +84,31 @@ class Sender(StrEnum):
     TOOL = "tool"
 
 
+def _mk_text(text: str) -> TextBlock:
+    """Build a user TextBlock via the Pydantic fast path; the input is our own
+    trusted string so re-running field validation per turn is wasted work."""
+    return TextBlock.model_construct(type="text", text=text)
+
+
 def setup_state(state):
-    if "messages" not in state:
-        state["messages"] = []
+    state.setdefault("messages", [])
     if "api_key" not in state:
         # Try to load API key from file first, then environment
-        state[
-            "api_key"] = ANTHROPIC_KEY
+        state["api_key"] = ANTHROPIC_KEY
         if not state["api_key"]:
             print("API key not found. Please set it in the environment or storage.")
-    if "provider" not in state:
-        state["provider"] = os.getenv("API_PROVIDER", "anthropic") or APIProvider.ANTHROPIC
-    if "provider_radio" not in state:
-        state["provider_radio"] = state["provider"]
+    state.setdefault("provider", os.getenv("API_PROVIDER", "anthropic") or APIProvider.ANTHROPIC)
+    state.setdefault("provider_radio", state["provider"])
     if "model" not in state:
         _reset_model(state)
-    if "auth_validated" not in state:
-        state["auth_validated"] = False
-    if "responses" not in state:
-        state["responses"] = {}
-    if "tools" not in state:
-        state["tools"] = {}
-    if "only_n_most_recent_images" not in state:
-        state["only_n_most_recent_images"] = 2  # 10
+    state.setdefault("auth_validated", False)
+    state.setdefault("responses", {})
+    state.setdefault("tools", {})
+    state.setdefault("only_n_most_recent_images", 2)  # 10
     if "custom_system_prompt" not in state:
-        state["custom_system_prompt"] = load_from_storage("system_prompt") or ""
         # remove if want to use default system prompt
-        device_os_name = "Windows" if platform.system() == "Windows" else "Mac" if platform.system() == "Darwin" else "Linux"
-        state["custom_system_prompt"] += f"\n\nNOTE: you are operating a {device_os_name} machine"
-    if "hide_images" not in state:
-        state["hide_images"] = False
+        state["custom_system_prompt"] = (load_from_storage("system_prompt") or "") + _DEFAULT_SYSTEM_PROMPT_SUFFIX
+    state.setdefault("hide_images", False)
 
 
 def _reset_model(state):
@@ -103,8 +122,16 @@ async def main(state):
 
 
 def validate_auth(provider: APIProvider, api_key: str | None):
+    """Memoized on (provider, key hash): boto3 / google.auth credential lookups
+    walk the filesystem or metadata service and take tens of ms per call."""
+    key_hash = hashlib.blake2b(api_key.encode(), digest_size=8).hexdigest() if api_key else None
+    return _validate_auth_cached(provider, key_hash)
+
+
+@lru_cache(maxsize=16)
+def _validate_auth_cached(provider: APIProvider, key_hash: str | None):
     if provider == APIProvider.ANTHROPIC:
-        if not api_key:
+        if not key_hash:
             return "Enter your Anthropic API key to continue."
     if provider == APIProvider.BEDROCK:
         import boto3
@@ -131,8 +158,8 @@ def load_from_storage(filename: str) -> str | None:
             data = file_path.read_text().strip()
             if data:
                 return data
-    except Exception as e:
-        print(f"Debug: Error loading {filename}: {e}")
+    except Exception:
+        logger.exception("Error loading %s", filename)
     return None
 
 
@@ -144,8 +171,43 @@ def save_to_storage(filename: str, data: str) -> None:
         file_path.write_text(data)
         # Ensure only user can read/write the file
         file_path.chmod(0o600)
-    except Exception as e:
-        print(f"Debug: Error saving {filename}: {e}")
+    except Exception:
+        logger.exception("Error saving %s", filename)
+
+
+async def save_to_storage_async(filename: str, data: str) -> None:
+    """Async variant of save_to_storage, for handlers running on the event loop."""
+    try:
+        CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+        file_path = CONFIG_DIR / filename
+        if aiofiles is not None:
+            async with aiofiles.open(file_path, "w") as f:
+                await f.write(data)
+        else:
+            await asyncio.to_thread(file_path.write_text, data)
+        # Ensure only user can read/write the file
+        await asyncio.to_thread(os.chmod, file_path, 0o600)
+    except Exception:
+        logger.exception("Error saving %s", filename)
+
+
+_pending_writes: Dict[str, asyncio.Task] = {}
+_WRITE_DEBOUNCE_SECONDS = 0.5
+
+
+async def debounced_save_to_storage(filename: str, data: str) -> None:
+    """Coalesce rapid consecutive saves (e.g. per-keystroke API-key changes)
+    into one write after a short quiet period."""
+    key = str(filename)
+    previous = _pending_writes.get(key)
+    if previous is not None and not previous.done():
+        previous.cancel()
+
+    async def _write_later():
+        await asyncio.sleep(_WRITE_DEBOUNCE_SECONDS)
+        await save_to_storage_async(filename, data)
+
+    _pending_writes[key] = asyncio.create_task(_write_later())
 
 
 def _api_response_callback(response: APIResponse[BetaMessage], response_state: dict):
@@ -157,6 +219,34 @@ def _tool_output_callback(tool_output: ToolResult, tool_id: str, tool_state: dic
     tool_state[tool_id] = tool_output
 
 
+_decode_cache: OrderedDict[str, bytes] = OrderedDict()
+_DECODE_CACHE_ENTRIES = 32
+
+
+def _decode_image(base64_image: str) -> bytes:
+    """LRU-cached base64 decode. Gradio history repaints re-render the same
+    100KB+ screenshot repeatedly; keying on the string reuses Python's cached
+    str hash, so repeat lookups for the same object are effectively free."""
+    cached = _decode_cache.get(base64_image)
+    if cached is not None:
+        _decode_cache.move_to_end(base64_image)
+        return cached
+    decoded = _b64decode(base64_image)
+    _decode_cache[base64_image] = decoded
+    while len(_decode_cache) > _DECODE_CACHE_ENTRIES:
+        _decode_cache.popitem(last=False)
+    return decoded
+
+
+@lru_cache(maxsize=4096)
+def _render_block_text(cls_name: str, text_or_name: str, input_repr: str | None) -> str:
+    """Memoized rendering for the hot text / tool-use branches; blocks are
+    immutable so the same block re-rendered on a history replay is a cache hit."""
+    if input_repr is None:
+        return text_or_name
+    return f"Tool Use: {text_or_name}\nInput: {input_repr}"
+
+
 def _render_message(sender: Sender, message: str | BetaTextBlock | BetaToolUseBlock | ToolResult, state):
     is_tool_result = not isinstance(message, str) and (
             isinstance(message, ToolResult)
@@ -177,11 +267,11 @@ def _render_message(sender: Sender, message: str | BetaTextBlock | BetaToolUseBl
         if message.error:
             return f"Error: {message.error}"
         if message.base64_image and not state["hide_images"]:
-            return base64.b64decode(message.base64_image)
+            return _decode_image(message.base64_image)
     elif isinstance(message, BetaTextBlock) or isinstance(message, TextBlock):
-        return message.text
+        return _render_block_text(message.__class__.__name__, message.text, None)
     elif isinstance(message, BetaToolUseBlock) or isinstance(message, ToolUseBlock):
-        return f"Tool Use: {message.name}\nInput: {message.input}"
+        return _render_block_text(message.__class__.__name__, message.name, repr(message.input))
     else:
         return message
 
@@ -198,7 +288,7 @@ def process_input(user_input, state):
     state["messages"].append(
         {
             "role": Sender.USER,
-            "content": [TextBlock(type="text", text=user_input)],
+            "content": [_mk_text(user_input)],
         }
     )
 
@@ -218,6 +308,44 @@ def process_input(user_input, state):
     # return results, state
 
 
+def _prune_old_images(messages, images_to_keep: int) -> None:
+    """
+    Replace all but the `images_to_keep` most recent screenshots in the history
+    with a small text placeholder, in place. Old base64 screenshots are 100KB+
+    each and would otherwise be re-serialized and re-uploaded on every API call.
+    """
+    if images_to_keep is None:
+        return
+    kept = 0
+    for message in reversed(messages):
+        content = message.get("content") if isinstance(message, dict) else None
+        if not isinstance(content, list):
+            continue
+        for block in reversed(content):
+            if not isinstance(block, dict) or block.get("type") != "tool_result":
+                continue
+            inner = block.get("content")
+            if not isinstance(inner, list):
+                continue
+            for i in range(len(inner) - 1, -1, -1):
+                item = inner[i]
+                if isinstance(item, dict) and item.get("type") == "image":
+                    kept += 1
+                    if kept > images_to_keep:
+                        inner[i] = {"type": "text", "text": "[screenshot omitted]"}
+
+
+def _last_user_text(messages) -> str | None:
+    """Pull the text of the most recent user turn, for semantic cache lookups."""
+    for message in reversed(messages or []):
+        if message.get("role") != Sender.USER:
+            continue
+        for block in message.get("content", []):
+            if isinstance(block, TextBlock):
+                return block.text
+    return None
+
+
 def accumulate_messages(*args, **kwargs):
     """
     Wrapper function to accumulate messages from sampling_loop_sync.
@@ -225,13 +353,119 @@ def accumulate_messages(*args, **kwargs):
     accumulated_messages = []
     global SELECTED_SCREEN_INDEX
     print(f"Selected screen: {SELECTED_SCREEN_INDEX}")
+
+    cache_key = last_user_text = None
+    if LLM_CACHE is not None:
+        cache_key = LLM_CACHE.make_key(
+            model=kwargs.get("model"),
+            provider=kwargs.get("provider"),
+            system_prompt_suffix=kwargs.get("system_prompt_suffix"),
+            messages=kwargs.get("messages"),
+        )
+        last_user_text = _last_user_text(kwargs.get("messages"))
+        cached_messages = LLM_CACHE.lookup(cache_key, last_user_text)
+        if cached_messages is not None:
+            # Replay only re-yields the recorded display messages; it does not
+            # append assistant/tool_result turns to state["messages"] the way a
+            # real sampling run would (see the llm_cache module docstring)
+            logger.info("LLM cache hit, replaying transcript")
+            yield from cached_messages
+            return
+
+    seen: set[bytes] = set()
     messages = sampling_loop_sync(*args, selected_screen=SELECTED_SCREEN_INDEX, **kwargs)
     for message in messages:
-        # Check if the message is already in the accumulated messages
-        if message not in accumulated_messages:
-            accumulated_messages.append(message)
-            # Yield the accumulated messages as a list to check the uniqueness of the mess
-            yield message
+        # Content-hash dedupe: O(1) per message instead of scanning the whole
+        # accumulated list, and it still catches recreated-but-equal objects
+        digest = hashlib.blake2b(repr(message).encode(), digest_size=16).digest()
+        if digest in seen:
+            continue
+        seen.add(digest)
+        accumulated_messages.append(message)
+        yield message
+
+    if LLM_CACHE is not None:
+        LLM_CACHE.store(cache_key, last_user_text, accumulated_messages)
+
+
+def _sse_frame(message) -> bytes:
+    """Serialize one message into a ready-to-send SSE byte frame."""
+    if orjson is not None:
+        payload = orjson.dumps(message, default=str)
+    else:
+        payload = json.dumps(message, default=str).encode()
+    return b"data: " + payload + b"\n\n"
+
+
+_SSE_FLUSH_BYTES = 4096
+_SSE_FLUSH_SECONDS = 0.1
+
+
+async def _batch_sse_frames(frames) -> AsyncGenerator:
+    """
+    Coalesce small SSE frames into ~4KB writes. Every yield to Starlette costs
+    a full ASGI response-body event plus a TCP write, so batching amortizes
+    that per-event overhead; a short timed flush keeps the stream live when
+    frames only trickle in.
+    """
+    buf = bytearray()
+    iterator = frames.__aiter__()
+    next_frame = asyncio.ensure_future(iterator.__anext__())
+    try:
+        while True:
+            try:
+                frame = await asyncio.wait_for(asyncio.shield(next_frame), _SSE_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                # No new frame within the window; flush what we have
+                if buf:
+                    out = bytes(buf)
+                    buf.clear()
+                    yield out
+                continue
+            except StopAsyncIteration:
+                break
+            except Exception:
+                # Source failed: flush already-buffered frames before propagating
+                if buf:
+                    out = bytes(buf)
+                    buf.clear()
+                    yield out
+                raise
+            buf.extend(frame)
+            next_frame = asyncio.ensure_future(iterator.__anext__())
+            if len(buf) >= _SSE_FLUSH_BYTES:
+                out = bytes(buf)
+                buf.clear()
+                yield out
+        if buf:
+            yield bytes(buf)
+    finally:
+        # Client disconnects close this generator mid-await; without this the
+        # shielded __anext__ task keeps pulling from the sampling stream and
+        # logs "Task exception was never retrieved" if it errors
+        next_frame.cancel()
+
+
+# Shared warm pool for draining the sync sampling loop. Bounding it caps the
+# number of concurrent Anthropic sessions from this process (the default
+# Starlette pool would allow 40), and reusing threads avoids per-request spawn.
+_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("LLM_MAX_WORKERS", "16")), thread_name_prefix="llm"
+)
+
+
+async def _iterate_in_thread(iterator) -> AsyncGenerator:
+    """
+    Drain a sync generator from a worker thread one item at a time, so an async
+    endpoint can stream its output without blocking the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    sentinel = object()
+    while True:
+        item = await loop.run_in_executor(_EXECUTOR, next, iterator, sentinel)
+        if item is sentinel:
+            break
+        yield item
 
 
 def yield_message(state):
@@ -239,6 +473,10 @@ def yield_message(state):
     if not state.get("api_key"):
         raise ValueError("API key is missing. Please set it in the environment or storage.")
 
+    # Drop stale screenshots up front; this also makes the cache key stable
+    # across turns that only differ in pruned images
+    _prune_old_images(state["messages"], state["only_n_most_recent_images"])
+
     # Call the sampling loop and yield messages
     for message in accumulate_messages(
             system_prompt_suffix=state["custom_system_prompt"],
@@ -270,7 +508,7 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
             with gr.Column():
                 provider = gr.Dropdown(
                     label="API Provider",
-                    choices=[option.value for option in APIProvider],
+                    choices=_PROVIDER_CHOICES,
                     value="anthropic",
                     interactive=True,
                 )
@@ -307,22 +545,38 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
         # hide_images = gr.Checkbox(label="Hide screenshots", value=False)
 
     # Define the merged dictionary with task mappings
-    merged_dict = json.load(open("examples/ootb_examples.json", "r"))
+    if orjson is not None:
+        with open("examples/ootb_examples.json", "rb") as f:
+            merged_dict = orjson.loads(f.read())
+    else:
+        with open("examples/ootb_examples.json", "r") as f:
+            merged_dict = json.load(f)
+
+    # Pre-index the three-level menu once so the callbacks below are single
+    # O(1) lookups instead of chained dict.get() walks on every UI event
+    _opts_by_cat = {c: tuple(cm) for c, cm in merged_dict.items()}
+    _tasks_by_co = {(c, o): tuple(om) for c, cm in merged_dict.items() for o, om in cm.items()}
+    _task_data = {
+        (c, o, t): d
+        for c, cm in merged_dict.items()
+        for o, om in cm.items()
+        for t, d in om.items()
+    }
 
 
     # Callback to update the second dropdown based on the first selection
     def update_second_menu(selected_category):
-        return gr.update(choices=list(merged_dict.get(selected_category, {}).keys()))
+        return gr.update(choices=_opts_by_cat.get(selected_category, ()))
 
 
     # Callback to update the third dropdown based on the second selection
     def update_third_menu(selected_category, selected_option):
-        return gr.update(choices=list(merged_dict.get(selected_category, {}).get(selected_option, {}).keys()))
+        return gr.update(choices=_tasks_by_co.get((selected_category, selected_option), ()))
 
 
     # Callback to update the textbox based on the third selection
     def update_textbox(selected_category, selected_option, selected_task):
-        task_data = merged_dict.get(selected_category, {}).get(selected_option, {}).get(selected_task, {})
+        task_data = _task_data.get((selected_category, selected_option, selected_task), {})
         prompt = task_data.get("prompt", "")
         preview_image = task_data.get("initial_state", "")
         task_hint = "Task Hint: " + task_data.get("hint", "")
@@ -342,9 +596,9 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
         with gr.Row():
             # Set initial values
             initial_category = "Game Play"
-            initial_second_options = list(merged_dict[initial_category].keys())
-            initial_third_options = list(merged_dict[initial_category][initial_second_options[0]].keys())
-            initial_text_value = merged_dict[initial_category][initial_second_options[0]][initial_third_options[0]]
+            initial_second_options = _opts_by_cat[initial_category]
+            initial_third_options = _tasks_by_co[(initial_category, initial_second_options[0])]
+            initial_text_value = _task_data[(initial_category, initial_second_options[0], initial_third_options[0])]
 
             with gr.Column(scale=2):
                 # First dropdown for Task Category
@@ -360,7 +614,7 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
                 # Third dropdown for Task
                 third_menu = gr.Dropdown(
                     # choices=initial_third_options, label="Task", interactive=True, value=initial_third_options[0]
-                    choices=["Please select a task"] + initial_third_options, label="Task", interactive=True,
+                    choices=["Please select a task", *initial_third_options], label="Task", interactive=True,
                     value="Please select a task"
                 )
 
@@ -371,7 +625,10 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
         # Textbox for displaying the mapped value
         # textbox = gr.Textbox(value=initial_text_value, label="Action")
 
-    api_key.change(fn=lambda key: save_to_storage(API_KEY_FILE, key), inputs=api_key)
+    async def _save_api_key(key):
+        await debounced_save_to_storage(API_KEY_FILE, key)
+
+    api_key.change(fn=_save_api_key, inputs=api_key)
 
     with gr.Row():
         # submit_button = gr.Button("Submit")  # Add submit button
@@ -433,15 +690,17 @@ async def process_input_api(request: Request):
     state["messages"].append(
         {
             "role": Sender.USER,
-            "content": [TextBlock(type="text", text=user_input)],
+            "content": [_mk_text(user_input)],
         }
     )
 
     # Call the sampling loop and yield messages
-    def message_generator() -> Generator:
+    async def message_generator() -> AsyncGenerator:
         try:
-            # Use accumulate_messages to yield individual messages
-            for message in accumulate_messages(
+            _prune_old_images(state["messages"], state["only_n_most_recent_images"])
+            # Pull from the sync sampling loop on a worker thread so each chunk
+            # reaches the client immediately instead of blocking the event loop
+            async for message in _iterate_in_thread(accumulate_messages(
                     system_prompt_suffix=state["custom_system_prompt"],
                     model=state["model"],
                     provider=state["provider"],
@@ -451,18 +710,49 @@ async def process_input_api(request: Request):
                     api_response_callback=partial(_api_response_callback, response_state=state["responses"]),
                     api_key=state["api_key"],
                     only_n_most_recent_images=state["only_n_most_recent_images"],
-            ):
+            )):
                 # Ensure each message is in the proper SSE format
-                yield f"data: {message}\n\n"
+                yield _sse_frame(message)
         except Exception as e:
-            yield f"data: Error: {str(e)}\n\n"
+            yield _sse_frame(f"Error: {str(e)}")
 
     # Return the streaming response in the correct content type
-    return StreamingResponse(message_generator(), media_type="text/event-stream")
+    return StreamingResponse(_batch_sse_frames(message_generator()), media_type="text/event-stream")
 
 # @app.post("/api/process-input-using-model", response_class=StreamingResponse)
 # async def process_input_api_using_model(request: Request):
-openai_client = OpenAI(api_key="***************************************************************")
+@lru_cache(maxsize=None)
+def _openai_client():
+    # Lazily imported/constructed on first use; importing openai eagerly adds
+    # noticeable cold-start time and most sessions never hit this endpoint
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key="***************************************************************")
+
+
+# Bound the number of in-flight OpenAI requests from this process
+_OPENAI_SEMAPHORE = asyncio.Semaphore(int(os.getenv("OPENAI_MAX_WORKERS", "4")))
+
+
+async def _openai_chat(**kwargs):
+    async with _OPENAI_SEMAPHORE:
+        return await _openai_client().chat.completions.create(**kwargs)
+
+
+# Structured output for the per-iteration follow-up decision, so one call
+# returns both the continue/stop verdict and the next prompt
+_FOLLOWUP_SCHEMA = {
+    "name": "followup_decision",
+    "schema": {
+        "type": "object",
+        "properties": {
+            "next_prompt": {"type": ["string", "null"]},
+            "done": {"type": "boolean"},
+        },
+        "required": ["done"],
+    },
+}
+
+
 @app.post("/api/process_input_api_using_model", response_class=StreamingResponse)
 async def process_input_loop(user_input: str = Form(...)):
     async def response_generator():
@@ -470,35 +760,64 @@ async def process_input_loop(user_input: str = Form(...)):
             # Initialize the conversation log
             conversation_log = []
 
-            # Step 1: Initialize the state and get the initial breakdown from OpenAI
-            openai_response = openai_client.chat.completions.create(
+            # Step 1: fire the breakdown call and set up state while it is in flight
+            breakdown_task = asyncio.create_task(_openai_chat(
                 model="gpt-4",
                 messages=[
                     {"role": "system", "content": "Break down the user's input into actionable steps."},
                     {"role": "user", "content": user_input},
                 ],
                 max_tokens=500,
-            )
-
-            current_prompt = openai_response.choices[0].message.content.strip()
-            conversation_log.append({"role": "OpenAI", "content": current_prompt})
-            yield f"data: OpenAI Processed Input:\n{current_prompt}\n\n"
+            ))
 
             state = {}
             setup_state(state)
             state["api_key"] = "**********************************************************************"
 
+            openai_response = await breakdown_task
+            current_prompt = openai_response.choices[0].message.content.strip()
+            conversation_log.append({"role": "OpenAI", "content": current_prompt})
+            yield _sse_frame(f"OpenAI Processed Input:\n{current_prompt}")
+
             while True:
                 # Step 2: Send the current prompt to Anthropic and stream the response
-                state["messages"].append(
-                    {
-                        "role": Sender.USER,
-                        "content": [TextBlock(type="text", text=current_prompt)],
-                    }
+                # (skip the append if the tail of the history is already this prompt)
+                last = state["messages"][-1] if state["messages"] else None
+                already_queued = (
+                    last is not None
+                    and last.get("role") == Sender.USER
+                    and isinstance(last.get("content"), list)
+                    and len(last["content"]) == 1
+                    and isinstance(last["content"][0], TextBlock)
+                    and last["content"][0].text == current_prompt
                 )
+                if not already_queued:
+                    state["messages"].append(
+                        {
+                            "role": Sender.USER,
+                            "content": [_mk_text(current_prompt)],
+                        }
+                    )
+
+                _prune_old_images(state["messages"], state["only_n_most_recent_images"])
+
+                followup_task = None
+
+                def _ask_followup(last_message):
+                    # Speculative next-step decision, issued while the Anthropic
+                    # stream is still going; superseded calls are cancelled below
+                    return asyncio.create_task(_openai_chat(
+                        model="gpt-4o-mini",
+                        response_format={"type": "json_schema", "json_schema": _FOLLOWUP_SCHEMA},
+                        messages=[
+                            {"role": "system", "content": "Based on the response, determine if more action is needed to satisfy the user's goal. If yes, set done=false and provide next_prompt. If no, set done=true."},
+                            {"role": "user", "content": f"User goal: {user_input}\nAnthropic response:\n{last_message}"},
+                        ],
+                        max_tokens=200,
+                    ))
 
                 try:
-                    for message in accumulate_messages(
+                    async for message in _iterate_in_thread(accumulate_messages(
                             system_prompt_suffix=state["custom_system_prompt"],
                             model=state["model"],
                             provider=state["provider"],
@@ -508,53 +827,54 @@ async def process_input_loop(user_input: str = Form(...)):
                             api_response_callback=partial(_api_response_callback, response_state=state["responses"]),
                             api_key=state["api_key"],
                             only_n_most_recent_images=state["only_n_most_recent_images"],
-                    ):
+                    )):
                         conversation_log.append({"role": "Anthropic", "content": message})
-                        yield f"data: Anthropic Response: {message}\n\n"
+                        yield _sse_frame(f"Anthropic Response: {message}")
+
+                        # A newer message supersedes any in-flight speculative call
+                        if followup_task is not None and not followup_task.done():
+                            followup_task.cancel()
+                        followup_task = _ask_followup(message)
 
                 except Exception as e:
                     error_message = f"Error from Anthropic: {str(e)}"
                     conversation_log.append({"role": "Anthropic", "content": error_message})
-                    yield f"data: {error_message}\n\n"
+                    yield _sse_frame(error_message)
+                    if followup_task is not None:
+                        followup_task.cancel()
                     break
 
-                # Step 3: Ask OpenAI if further action is needed
-                openai_followup = openai_client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[
-                        {"role": "system", "content": "Based on the response, determine if more action is needed. If yes, provide the next prompt. If no, state 'FINAL RESPONSE'."},
-                        {"role": "user", "content": f"Anthropic response:\n{message}"},
-                    ],
-                    max_tokens=200,
-                )
+                # Step 3: the follow-up decision for the last message is usually
+                # already in flight (or done) by the time the stream closes
+                if followup_task is None:
+                    break
+                openai_followup = await followup_task
 
-                followup_content = openai_followup.choices[0].message.content.strip()
-                conversation_log.append({"role": "OpenAI", "content": followup_content})
-                yield f"data: OpenAI Follow-Up:\n{followup_content}\n\n"
+                raw_decision = openai_followup.choices[0].message.content
+                decision = orjson.loads(raw_decision) if orjson is not None else json.loads(raw_decision)
+                conversation_log.append({"role": "OpenAI", "content": decision})
+                yield _sse_frame(f"OpenAI Follow-Up:\n{raw_decision}")
 
-                # Print the conversation log to the console
-                print(json.dumps({
-                    "conversation": conversation_log
-                }, indent=2))
+                # Log only the newest entry; re-serializing the whole log each
+                # turn is O(N^2) and blocks the loop on stdout I/O
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("turn %d: %s", len(conversation_log), conversation_log[-1])
 
                 # Check if OpenAI says it's the final response
-                if "FINAL RESPONSE" in followup_content.upper():
-                    yield f"data: Conversation closed by OpenAI.\n\n"
+                if decision.get("done") or not decision.get("next_prompt"):
+                    yield _sse_frame("Conversation closed by OpenAI.")
                     break
 
                 # Update the prompt for the next loop iteration
-                current_prompt = followup_content
+                current_prompt = decision["next_prompt"]
 
         except Exception as e:
             error_message = f"Error: {str(e)}"
             conversation_log.append({"role": "System", "content": error_message})
-            print(json.dumps({
-                "timestamp": str(datetime.datetime.now()),
-                "conversation": conversation_log
-            }, indent=2))
-            yield f"data: {error_message}\n\n"
+            logger.exception("process_input_loop failed after %d turns", len(conversation_log))
+            yield _sse_frame(error_message)
 
-    return StreamingResponse(response_generator(), media_type="text/event-stream")
+    return StreamingResponse(_batch_sse_frames(response_generator()), media_type="text/event-stream")
 
 # def process_input(user_input, state):
 #     if state is None:
@@ -570,24 +890,27 @@ async def process_input_loop(user_input: str = Form(...)):
 #     return response, state
 
 
-def run_gradio():
-    # Define Gradio interface with state as both input and output
-    demo = gr.Interface(
-        fn=process_input,
-        inputs=[gr.Textbox(label="Enter Input"), gr.State()],
-        outputs=[gr.Textbox(), gr.State()]
-    )
-    demo.launch(share=True, server_name="localhost", server_port=7861)
+# Serve the Gradio UI from the same event loop as the API instead of a second
+# server on its own thread
+app = gr.mount_gradio_app(app, demo, path="/ui")
 
 
 def run_fastapi():
-    uvicorn.run("app:app", host="localhost", port=8001)
+    try:
+        import uvloop  # noqa: F401
+        loop = "uvloop"
+    except ImportError:
+        loop = "auto"
+    try:
+        import httptools  # noqa: F401
+        http = "httptools"
+    except ImportError:
+        http = "auto"
+    # Stay single-worker: the server shares this process with Gradio, and
+    # multi-worker would respawn the whole module (screens, state) per process
+    uvicorn.run("app:app", host="localhost", port=8001, loop=loop, http=http, log_level="warning")
 
 
 if __name__ == "__main__":
-    # Start FastAPI in a separate thread
-    fastapi_thread = Thread(target=run_fastapi)
-    fastapi_thread.start()
-
-    # Run Gradio in the main thread
-    run_gradio()
+    # Single server: FastAPI at /api/*, Gradio UI mounted at /ui
+    run_fastapi()
@@ -0,0 +1,257 @@
+"""
+Optional response cache that sits in front of sampling_loop_sync.
+
+A completed transcript (the messages yielded for one user turn) is stored under a
+key derived from (model, provider, system_prompt_suffix, messages). On a later
+identical request the whole remote sampling round trip is skipped and the cached
+transcript is replayed. If an OpenAI API key is available, near-duplicate user
+turns can also be matched by cosine similarity over embeddings of the last user
+message.
+
+Limitation: a replay only re-yields the recorded display messages. It does not
+re-run tools, and it does not append the assistant/tool_result turns that
+sampling_loop_sync would have added to the caller's message history in place —
+so a long-lived history that takes a cache hit diverges from one that ran the
+turn for real. Callers holding persistent state (the Gradio session) should
+treat a hit as terminal for that turn or reconcile the history themselves.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Protocol
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 128
+DEFAULT_TTL_SECONDS = 3600.0
+DEFAULT_SIMILARITY_THRESHOLD = 0.92
+EMBEDDING_MODEL = "text-embedding-3-small"
+MAX_EMBEDDINGS = DEFAULT_MAX_ENTRIES
+
+
+class CacheBackend(Protocol):
+    """Minimal storage interface the cache layers on top of."""
+
+    def get(self, key: str) -> Any | None: ...
+
+    def set(self, key: str, value: Any) -> None: ...
+
+    def delete(self, key: str) -> None: ...
+
+    def clear(self) -> None: ...
+
+
+class InMemoryBackend:
+    """dict-backed LRU backend with per-entry TTL eviction."""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if self.ttl and time.monotonic() - stored_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+class DiskCacheBackend:
+    """diskcache-backed backend so cached transcripts survive restarts."""
+
+    def __init__(self, directory: str, ttl: float = DEFAULT_TTL_SECONDS):
+        if diskcache is None:
+            raise RuntimeError("diskcache is not installed; use InMemoryBackend instead")
+        self.ttl = ttl
+        self._cache = diskcache.Cache(directory)
+
+    def get(self, key: str) -> Any | None:
+        return self._cache.get(key)
+
+    def set(self, key: str, value: Any) -> None:
+        self._cache.set(key, value, expire=self.ttl or None)
+
+    def delete(self, key: str) -> None:
+        self._cache.delete(key)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+
+class LLMCache:
+    """
+    Exact-key cache with optional semantic near-match over the last user turn.
+    """
+
+    def __init__(
+        self,
+        backend: CacheBackend | None = None,
+        similarity_threshold: float = DEFAULT_SIMILARITY_THRESHOLD,
+        only_cache_deterministic: bool = False,
+        openai_client=None,
+    ):
+        self.backend = backend if backend is not None else InMemoryBackend()
+        self.similarity_threshold = similarity_threshold
+        self.only_cache_deterministic = only_cache_deterministic
+        self.openai_client = openai_client
+        # Parallel lists: row i of the embedding matrix belongs to _embedded_keys[i]
+        self._embedded_keys: list[str] = []
+        self._embeddings = None
+
+    @classmethod
+    def from_env(cls, openai_client=None) -> "LLMCache | None":
+        """Build a cache from LLM_CACHE* environment variables, or None if disabled.
+
+        When no client is passed and OPENAI_API_KEY is set, a sync OpenAI client
+        is constructed for the semantic near-match path (_embed is sync, so the
+        app's AsyncOpenAI client cannot be reused here)."""
+        if os.getenv("LLM_CACHE", "").lower() not in ("1", "true", "yes", "on"):
+            return None
+        if openai_client is None and os.getenv("OPENAI_API_KEY"):
+            try:
+                from openai import OpenAI
+                openai_client = OpenAI()
+            except ImportError:
+                logger.warning("OPENAI_API_KEY set but openai not installed; semantic cache matching disabled")
+        ttl = float(os.getenv("LLM_CACHE_TTL", str(DEFAULT_TTL_SECONDS)))
+        cache_dir = os.getenv("LLM_CACHE_DIR")
+        if cache_dir and diskcache is not None:
+            backend = DiskCacheBackend(cache_dir, ttl=ttl)
+        else:
+            backend = InMemoryBackend(ttl=ttl)
+        return cls(
+            backend=backend,
+            similarity_threshold=float(
+                os.getenv("LLM_CACHE_THRESHOLD", str(DEFAULT_SIMILARITY_THRESHOLD))
+            ),
+            only_cache_deterministic=os.getenv("LLM_CACHE_DETERMINISTIC_ONLY", "").lower()
+            in ("1", "true", "yes", "on"),
+            openai_client=openai_client,
+        )
+
+    @staticmethod
+    def make_key(*, model, provider, system_prompt_suffix, messages) -> str:
+        payload = json.dumps(
+            {
+                "model": model,
+                "provider": provider,
+                "suffix": system_prompt_suffix,
+                "messages": messages,
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def lookup(self, key: str, last_user_text: str | None = None) -> list | None:
+        cached = self.backend.get(key)
+        if cached is not None:
+            return cached
+        if last_user_text:
+            near_key = self._nearest_key(last_user_text)
+            if near_key is not None:
+                cached = self.backend.get(near_key)
+                if cached is None:
+                    # The backend evicted this entry; drop its embedding row too
+                    self._forget_embedding(near_key)
+                return cached
+        return None
+
+    def store(
+        self,
+        key: str,
+        last_user_text: str | None,
+        transcript: list,
+        deterministic: bool = True,
+    ) -> None:
+        if self.only_cache_deterministic and not deterministic:
+            return
+        self.backend.set(key, list(transcript))
+        if last_user_text:
+            self._remember_embedding(key, last_user_text)
+
+    def _embed(self, text: str):
+        """Embed text for near-match lookup; returns None when unavailable."""
+        if self.openai_client is None or np is None:
+            return None
+        try:
+            response = self.openai_client.embeddings.create(
+                model=EMBEDDING_MODEL, input=[text]
+            )
+        except Exception:
+            logger.exception("embedding request failed")
+            return None
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return None
+        return vector / norm
+
+    def _remember_embedding(self, key: str, text: str) -> None:
+        vector = self._embed(text)
+        if vector is None:
+            return
+        if key in self._embedded_keys:
+            # Re-store of a known key: refresh its row instead of appending
+            self._embeddings[self._embedded_keys.index(key)] = vector
+            return
+        self._embedded_keys.append(key)
+        if self._embeddings is None:
+            self._embeddings = vector[np.newaxis, :]
+        else:
+            self._embeddings = np.vstack([self._embeddings, vector])
+        while len(self._embedded_keys) > MAX_EMBEDDINGS:
+            self._embedded_keys.pop(0)
+            self._embeddings = self._embeddings[1:]
+
+    def _forget_embedding(self, key: str) -> None:
+        try:
+            row = self._embedded_keys.index(key)
+        except ValueError:
+            return
+        self._embedded_keys.pop(row)
+        self._embeddings = np.delete(self._embeddings, row, axis=0)
+        if not self._embedded_keys:
+            self._embeddings = None
+
+    def _nearest_key(self, text: str) -> str | None:
+        if self._embeddings is None or not self._embedded_keys:
+            return None
+        vector = self._embed(text)
+        if vector is None:
+            return None
+        similarities = self._embeddings @ vector
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.similarity_threshold:
+            return self._embedded_keys[best]
+        return None
@@ -0,0 +1,131 @@
+from unittest import mock
+
+from computer_use_demo.llm_cache import InMemoryBackend, LLMCache
+
+
+def make_key(messages):
+    return LLMCache.make_key(
+        model="claude-3-5-sonnet-20241022",
+        provider="anthropic",
+        system_prompt_suffix="",
+        messages=messages,
+    )
+
+
+def test_exact_hit():
+    cache = LLMCache()
+    key = make_key([{"role": "user", "content": "hello"}])
+    assert cache.lookup(key) is None
+    cache.store(key, None, ["message one", "message two"])
+    assert cache.lookup(key) == ["message one", "message two"]
+
+
+def test_key_changes_with_messages():
+    key_a = make_key([{"role": "user", "content": "hello"}])
+    key_b = make_key([{"role": "user", "content": "goodbye"}])
+    assert key_a != key_b
+
+
+def test_ttl_eviction():
+    backend = InMemoryBackend(ttl=10.0)
+    cache = LLMCache(backend=backend)
+    key = make_key([{"role": "user", "content": "hello"}])
+    cache.store(key, None, ["message"])
+    with mock.patch("computer_use_demo.llm_cache.time.monotonic", return_value=1e9):
+        assert cache.lookup(key) is None
+
+
+def test_lru_eviction():
+    backend = InMemoryBackend(max_entries=2)
+    cache = LLMCache(backend=backend)
+    keys = [make_key([{"role": "user", "content": str(i)}]) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.store(key, None, [str(i)])
+    assert cache.lookup(keys[0]) is None
+    assert cache.lookup(keys[1]) == ["1"]
+    assert cache.lookup(keys[2]) == ["2"]
+
+
+def test_only_cache_deterministic():
+    cache = LLMCache(only_cache_deterministic=True)
+    key = make_key([{"role": "user", "content": "hello"}])
+    cache.store(key, None, ["message"], deterministic=False)
+    assert cache.lookup(key) is None
+    cache.store(key, None, ["message"], deterministic=True)
+    assert cache.lookup(key) == ["message"]
+
+
+def test_semantic_near_match():
+    embeddings = {
+        "open the browser": [1.0, 0.0],
+        "open the web browser": [0.99, 0.14],
+        "delete everything": [0.0, 1.0],
+    }
+
+    def fake_create(**kwargs):
+        return mock.Mock(data=[mock.Mock(embedding=embeddings[kwargs["input"][0]])])
+
+    openai_client = mock.Mock()
+    openai_client.embeddings.create.side_effect = fake_create
+
+    cache = LLMCache(openai_client=openai_client)
+    key = make_key([{"role": "user", "content": "open the browser"}])
+    cache.store(key, "open the browser", ["transcript"])
+
+    near_key = make_key([{"role": "user", "content": "open the web browser"}])
+    assert cache.lookup(near_key, "open the web browser") == ["transcript"]
+
+    far_key = make_key([{"role": "user", "content": "delete everything"}])
+    assert cache.lookup(far_key, "delete everything") is None
+
+
+def test_embeddings_stay_bounded():
+    def fake_create(**kwargs):
+        return mock.Mock(data=[mock.Mock(embedding=[1.0, 0.0])])
+
+    openai_client = mock.Mock()
+    openai_client.embeddings.create.side_effect = fake_create
+
+    cache = LLMCache(openai_client=openai_client)
+    key = make_key([{"role": "user", "content": "hello"}])
+    cache.store(key, "hello", ["one"])
+    cache.store(key, "hello", ["two"])
+    assert cache._embedded_keys == [key]
+    assert cache._embeddings.shape == (1, 2)
+
+    with mock.patch("computer_use_demo.llm_cache.MAX_EMBEDDINGS", 2):
+        for i in range(3):
+            cache.store(make_key([{"role": "user", "content": str(i)}]), str(i), [str(i)])
+    assert len(cache._embedded_keys) == 2
+    assert cache._embeddings.shape == (2, 2)
+
+
+def test_evicted_backend_entry_drops_embedding():
+    def fake_create(**kwargs):
+        return mock.Mock(data=[mock.Mock(embedding=[1.0, 0.0])])
+
+    openai_client = mock.Mock()
+    openai_client.embeddings.create.side_effect = fake_create
+
+    cache = LLMCache(openai_client=openai_client)
+    key = make_key([{"role": "user", "content": "hello"}])
+    cache.store(key, "hello", ["transcript"])
+    cache.backend.delete(key)
+
+    other_key = make_key([{"role": "user", "content": "hello there"}])
+    assert cache.lookup(other_key, "hello there") is None
+    assert cache._embedded_keys == []
+    assert cache._embeddings is None
+
+
+def test_from_env_disabled_by_default():
+    with mock.patch.dict("os.environ", {}, clear=True):
+        assert LLMCache.from_env() is None
+
+
+def test_from_env_builds_embedding_client():
+    env = {"LLM_CACHE": "1", "OPENAI_API_KEY": "sk-test"}
+    with mock.patch.dict("os.environ", env, clear=True):
+        cache = LLMCache.from_env()
+    assert cache is not None
+    assert cache.openai_client is not None